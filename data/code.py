@@ -18,6 +18,8 @@ class CodeConfig:
         self.source_code_dir = self.code_config["code_store"]["source_code_dir"]
         self.supported_languages = self.code_config["supported_languages"]
         self.language_convert = self.code_config["language_convert"]
+        # 按请求中的语言名缓存解析后的语言配置, 同一语言只解析一次
+        self._language_configs = {}
 
     def load_config(self, config_path):
         try:
@@ -52,13 +54,17 @@ class CodeConfig:
         return config
 
     def get_language_config(self, language):
-        language = self.language_convert.get(language.lower(), language.lower())
-        if language not in self.supported_languages:
-            raise ValueError(f"不支持的语言: {language}")
-        language_config = dict(self.supported_languages[language])
-        language_config["lang"] = language
-        language_config["source_code_dir"] = os.path.join(self.source_code_dir, language)
-        return language_config
+        language_config = self._language_configs.get(language)
+        if language_config is None:
+            name = self.language_convert.get(language.lower(), language.lower())
+            if name not in self.supported_languages:
+                raise ValueError(f"不支持的语言: {name}")
+            language_config = dict(self.supported_languages[name])
+            language_config["lang"] = name
+            language_config["source_code_dir"] = os.path.join(self.source_code_dir, name)
+            self._language_configs[language] = language_config
+        # 调用方会修改返回的配置, 每次返回副本
+        return dict(language_config)
 
 class SyntaxChecker:
     def __init__(self):
@@ -88,6 +94,8 @@ class CodeStore:
     def __init__(self):
         self.code_config = CodeConfig()
         self.syntax_checker = SyntaxChecker()
+        # 已完成special_setup的语言, 每个进程每种语言只需执行一次
+        self._special_setup_done = set()
 
     def get_code_config(self):
         return self.code_config
@@ -140,10 +148,20 @@ class CodeStore:
                 elif action == "change_ownership":
                     self.change_ownership(path)
 
-    def build_code_env(self, request_data):
+    def build_code_env_inplace(self, request_data, workdir):
+        """在调用方持有的固定目录中构建代码环境, 先清空上一次运行留下的文件(.class、reports等), 目录本身保留复用"""
+        with os.scandir(workdir) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.unlink(entry.path)
+        return self.build_code_env(request_data, code_dir=workdir)
+
+    def build_code_env(self, request_data, code_dir=None):
         language = request_data["lang"]
         source_code = request_data["source_code"]
-        language_config = self.code_config.get_language_config(language).copy()
+        language_config = self.code_config.get_language_config(language)
         language_config["src_uid"] = request_data["src_uid"]
         # 处理go语言的特殊设置
         if language_config["lang"] == "go":
@@ -154,7 +172,8 @@ class CodeStore:
             else:
                 language_config["go_test_method"] = "test"
 
-        code_dir = os.path.join(language_config["source_code_dir"], uuid.uuid4().hex)
+        if code_dir is None:
+            code_dir = os.path.join(language_config["source_code_dir"], uuid.uuid4().hex)
         if not os.path.exists(code_dir):
             os.makedirs(code_dir)
         code_path = os.path.join(code_dir, language_config["file_name_template"])
@@ -166,8 +185,9 @@ class CodeStore:
             language_config["syntax_error"] = True
             return language_config
 
-        if SANDBOX_UID is not None:
+        if SANDBOX_UID is not None and language_config["lang"] not in self._special_setup_done:
             self._perform_special_setup(language_config["lang"])
+            self._special_setup_done.add(language_config["lang"])
 
         # 处理特殊的handler环境设置
         if "handler" in language_config:
@@ -1,11 +1,80 @@
 import os
 import sys
+import time
+import queue
+import atexit
 import logging
+import logging.handlers
 from pathlib import Path
 
 # Log directory: use local ./logs on Windows so /data/logs is not required
 LOG_DIR = str(Path(__file__).resolve().parent / "logs") if os.name == "nt" else "/data/logs"
 
+# 日志格式不包含线程/进程信息, 创建LogRecord时无需查询
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
+
+LOG_FORMAT = '%(asctime)s %(filename)s:%(lineno)d %(levelname)s - %(message)s'
+
+
+class CachedTimeFormatter(logging.Formatter):
+    """按秒缓存asctime的秒级部分, 每秒只调用一次strftime"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._cached_second = None
+        self._cached_time = ""
+
+    def formatTime(self, record, datefmt=None):
+        if datefmt:
+            return super().formatTime(record, datefmt)
+        second = int(record.created)
+        if second != self._cached_second:
+            self._cached_time = time.strftime(self.default_time_format, self.converter(record.created))
+            self._cached_second = second
+        return self.default_msec_format % (self._cached_time, record.msecs)
+
+
+class DeferredFlushFileHandler(logging.FileHandler):
+    """逐条emit时不flush, 由BatchFlushHandler整批写入后统一flush"""
+
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        super().flush()
+
+
+class BatchFlushHandler(logging.handlers.MemoryHandler):
+    """缓存日志记录, 达到capacity或出现ERROR时整批写入目标文件, 每批只flush一次"""
+
+    def flush(self):
+        super().flush()
+        self.acquire()
+        try:
+            if self.target is not None:
+                self.target.flush_batch()
+        finally:
+            self.release()
+
+
+# 每个日志记录器对应一个后台QueueListener, 由它负责实际的文件/控制台写入
+_listeners = []
+
+
+def _stop_listeners():
+    """停止所有QueueListener, 写出队列中剩余的日志"""
+    # 全部停止并flush后再清空列表, 期间保持对各处理器的引用
+    for listener in _listeners:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.flush()
+    _listeners.clear()
+
+
+atexit.register(_stop_listeners)
+
 
 def _safe_stderr():
     """Use UTF-8 for stderr so non-ASCII log messages don't crash on Windows (cp1252)."""
@@ -13,6 +82,10 @@ def _safe_stderr():
         return __import__("io").TextIOWrapper(sys.stderr.buffer, encoding="utf-8", errors="replace")
     return sys.stderr
 
+
+# 所有控制台处理器共用同一个stderr包装; 包装被回收时会关闭底层的sys.stderr.buffer
+_STDERR = _safe_stderr()
+
 def setup_logger(name="sandbox", file_name=None):
     """设置并返回配置好的日志记录器
     
@@ -42,22 +115,32 @@ def setup_logger(name="sandbox", file_name=None):
     logger.setLevel(logging.INFO)
 
     # FileHandler with UTF-8 so log file can hold any message
-    file_handler = logging.FileHandler(log_file, encoding="utf-8")
+    file_handler = DeferredFlushFileHandler(log_file, encoding="utf-8")
     file_handler.setLevel(logging.INFO)
+    # 文件写入按1000条或ERROR级别成批进行, 进程异常退出时最多丢失一批未写出的日志
+    batch_handler = BatchFlushHandler(
+        capacity=1000, flushLevel=logging.ERROR, target=file_handler, flushOnClose=True
+    )
+    batch_handler.setLevel(logging.INFO)
 
     # 创建控制台处理器 (UTF-8 on Windows to avoid UnicodeEncodeError)
-    console_handler = logging.StreamHandler(_safe_stderr())
+    console_handler = logging.StreamHandler(_STDERR)
     console_handler.setLevel(logging.INFO)
 
     # 创建格式化器
-    formatter = logging.Formatter('%(asctime)s %(threadName)s %(filename)s:%(funcName)s:%(lineno)d %(levelname)s - %(message)s')
+    formatter = CachedTimeFormatter(LOG_FORMAT)
     file_handler.setFormatter(formatter)
     console_handler.setFormatter(formatter)
 
-    # 将处理器添加到记录器
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-    
+    # 记录器只负责入队, 文件和控制台写入由后台线程完成, 不阻塞调用方
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(
+        log_queue, batch_handler, console_handler, respect_handler_level=True
+    )
+    listener.start()
+    _listeners.append(listener)
+
     return logger
 
 # 创建默认的日志记录器
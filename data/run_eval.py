@@ -2,12 +2,21 @@
 Run solutions from a JSONL file and write one CSV row per question.
 Output: 14 columns — question_id, question, s1_solution, s2_solution, s3_solution,
         then for each solution: output, runtime_s, space_kb.
-Usage: python run_eval.py <input.jsonl> [--out results.csv]
+Usage: python run_eval.py <input.jsonl> [--out results.csv] [--workers N]
+  --workers N  run N solutions in parallel (default 1). runtime_s is wall time judged
+               against a fixed timeout, so N > 1 inflates it and can turn borderline
+               passes into TIME_LIMIT_EXCEEDED; use only when timings do not matter.
 """
+import atexit
 import csv
 import json
+import multiprocessing
+import os
+import shutil
 import sys
+import tempfile
 import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from pathlib import Path
 
 # run from data/ so local imports work
@@ -17,10 +26,25 @@ from code import CodeStore
 from code_splicer import CodeSplicer
 from executor import LanguageExecutor
 
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 TIMEOUT = 5
+CSV_BUFFER_SIZE = 1024 * 1024
+
+# Per-worker instances, set up once by init_worker
+_code_store = None
+_code_splicer = None
+_executor = None
+_workdir = None
 
 
-def run_one(record, code_store, code_splicer, executor):
+def run_one(record, code_store, code_splicer, executor, workdir=None):
+    """Run one solution; returns (question_id, solution_id, output, runtime_s, space_kb, main_code)
+    where main_code is the harness with literal "\\n" escapes already expanded."""
     lang = record["lang"]
     func_code = record["func_code"]
     main_code = record.get("main_code", "")
@@ -33,11 +57,14 @@ def run_one(record, code_store, code_splicer, executor):
     spliced = code_splicer.splice_code(lang, func_code, main_code)["spliced_code"]
     request_data = {"src_uid": src_uid, "lang": lang, "source_code": spliced}
 
-    language_config = code_store.build_code_env(request_data)
+    if workdir is None:
+        language_config = code_store.build_code_env(request_data)
+    else:
+        language_config = code_store.build_code_env_inplace(request_data, workdir)
     try:
         if language_config.get("syntax_error"):
             print(f"[{question_id}_{solution_id}] error: Syntax error in code", file=sys.stderr)
-            return question_id, solution_id, "Syntax error in code", 0.0, 0
+            return question_id, solution_id, "Syntax error in code", 0.0, 0, main_code
 
         start = time.time()
         result = executor.execute(language_config, TIMEOUT)
@@ -58,40 +85,92 @@ def run_one(record, code_store, code_splicer, executor):
 
         if outcome != "PASSED":
             print(f"[{question_id}_{solution_id}] error:\n{output}", file=sys.stderr)
-        return question_id, solution_id, output, runtime, space_kb
+        return question_id, solution_id, output, runtime, space_kb, main_code
     finally:
-        code_store.destroy_code_env(language_config)
+        if workdir is None:
+            code_store.destroy_code_env(language_config)
+
+
+def sort_key(qid):
+    """Numeric question ids first, in numeric order; then the rest as strings."""
+    s = str(qid)
+    if s.isdigit():
+        return (0, int(s))
+    return (1, s)
+
+
+def init_worker():
+    global _code_store, _code_splicer, _executor, _workdir
+    _code_store = CodeStore()
+    _code_splicer = CodeSplicer()
+    _executor = LanguageExecutor()
+    # One sandbox directory per worker, emptied and reused for every record
+    source_code_dir = _code_store.get_code_config().source_code_dir
+    os.makedirs(source_code_dir, exist_ok=True)
+    _workdir = tempfile.mkdtemp(prefix="worker_", dir=source_code_dir)
+    atexit.register(shutil.rmtree, _workdir, ignore_errors=True)
+
+
+def run_one_in_worker(record):
+    return run_one(record, _code_store, _code_splicer, _executor, _workdir)
 
 
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python run_eval.py <input.jsonl> [--out results.csv]", file=sys.stderr)
+    usage = (
+        "Usage: python run_eval.py <input.jsonl> [--out results.csv] [--workers N]\n"
+        "  --workers N  parallel runs (default 1); N > 1 inflates runtime_s and can cause TIME_LIMIT_EXCEEDED"
+    )
+    if len(sys.argv) < 2 or len(sys.argv) % 2 != 0:
+        print(usage, file=sys.stderr)
         sys.exit(1)
 
     input_path = Path(sys.argv[1])
     out_path = Path("results.csv")
-    if len(sys.argv) >= 4 and sys.argv[2] == "--out":
-        out_path = Path(sys.argv[3])
-
-    code_store = CodeStore()
-    code_splicer = CodeSplicer()
-    executor = LanguageExecutor()
+    workers = 1
+    for flag, value in zip(sys.argv[2::2], sys.argv[3::2]):
+        if flag == "--out":
+            out_path = Path(value)
+        elif flag == "--workers":
+            workers = max(1, int(value))
+        else:
+            print(usage, file=sys.stderr)
+            sys.exit(1)
+    if workers > 1:
+        print(
+            f"Warning: --workers {workers} runs solutions concurrently; runtime_s will be inflated "
+            "and borderline solutions may hit TIME_LIMIT_EXCEEDED",
+            file=sys.stderr,
+        )
 
     rows_by_question = {}
-    with open(input_path, "r", encoding="utf-8") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            rec = json.loads(line)
-            qid, sid, outcome, runtime, space = run_one(rec, code_store, code_splicer, executor)
-            func_code = rec.get("func_code", "")
-            if qid not in rows_by_question:
-                main_code = rec.get("main_code", "")
-                if "\\n" in main_code and "\n" not in main_code:
-                    main_code = main_code.replace("\\n", "\n")
-                rows_by_question[qid] = {"_question": rec.get("question", ""), "_main_code": main_code}
-            rows_by_question[qid][sid] = (outcome, runtime, space, func_code)
+    # future -> fields of its record still needed for the CSV row
+    pending = {}
+
+    def collect(done):
+        for fut in done:
+            question, func_code = pending.pop(fut)
+            qid, sid, outcome, runtime, space, main_code = fut.result()
+            bucket = rows_by_question.get(qid)
+            if bucket is None:
+                bucket = rows_by_question[qid] = {"_question": question, "_main_code": main_code, "_sk": sort_key(qid)}
+            bucket[sid] = (outcome, runtime, space, func_code)
+
+    # spawn: workers build their own CodeStore/logger instead of inheriting
+    # the parent's logging state through fork
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=init_worker) as pool:
+        with open(input_path, "rb") as f:
+            for line in f:
+                if line.isspace():
+                    continue
+                rec = json_loads(line)
+                fut = pool.submit(run_one_in_worker, rec)
+                pending[fut] = (rec.get("question", ""), rec.get("func_code", ""))
+                # keep at most 2 records per worker in flight so the input is not buffered whole
+                if len(pending) >= 2 * workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+        collect(list(pending))
 
     # question_id, question, full_test_func, then s1/s2/s3 solution + metrics
     headers = ["question_id", "question", "full_test_func",
@@ -99,26 +178,23 @@ def main():
                "s2_solution", "s2_output", "s2_runtime_s", "s2_space_kb",
                "s3_solution", "s3_output", "s3_runtime_s", "s3_space_kb"]
 
-    def _sort_key(qid):
-        s = str(qid)
-        if s.isdigit():
-            return (0, int(s))
-        return (1, s)
-
-    with open(out_path, "w", newline="", encoding="utf-8") as f:
-        w = csv.writer(f)
-        w.writerow(headers)
-        for qid in sorted(rows_by_question.keys(), key=_sort_key):
-            row = rows_by_question[qid]
+    def _csv_rows():
+        for qid, row in sorted(rows_by_question.items(), key=lambda kv: kv[1]["_sk"]):
             q_text = row.get("_question", "")
             main_code = row.get("_main_code", "")
             s1 = row.get("s1", ("", 0, 0, ""))
             s2 = row.get("s2", ("", 0, 0, ""))
             s3 = row.get("s3", ("", 0, 0, ""))
-            w.writerow([qid, q_text, main_code,
-                        s1[3], s1[0], s1[1], s1[2],
-                        s2[3], s2[0], s2[1], s2[2],
-                        s3[3], s3[0], s3[1], s3[2]])
+            yield [qid, q_text, main_code,
+                   s1[3], s1[0], s1[1], s1[2],
+                   s2[3], s2[0], s2[1], s2[2],
+                   s3[3], s3[0], s3[1], s3[2]]
+
+    # One large write buffer and a single writerows call instead of a Python-level writerow loop
+    with open(out_path, "w", newline="", encoding="utf-8", buffering=CSV_BUFFER_SIZE) as f:
+        w = csv.writer(f)
+        w.writerow(headers)
+        w.writerows(_csv_rows())
 
     print(f"Wrote {out_path}", file=sys.stderr)
 
@@ -1,5 +1,8 @@
+import asyncio
 import json
 import os
+import re
+import selectors
 import signal
 import subprocess
 import threading
@@ -9,71 +12,126 @@ from typing import List
 from log import setup_logger
 from env import SANDBOX_UID, SANDBOX_GID, ENV
 
-try:
-    import fcntl
-except ImportError:
-    fcntl = None
-
 # 初始化日志
 logger = setup_logger()
 
-MAX_BYTES_PER_READ = 1024
+MAX_BYTES_PER_READ = 65536
 SLEEP_BETWEEN_READS = 0.1
+# 输出超过max_output_size时, 在保存的内容末尾追加此标记
+TRUNCATED_MARKER = b"\n... (truncated)"
+# 资源采样间隔从SLEEP_BETWEEN_READS开始倍增, 上限为SAMPLE_INTERVAL_MAX (VmPeak本身就是峰值)
+SAMPLE_INTERVAL_MAX = 1.0
 try:
     SC_CLK_TCK = os.sysconf(os.sysconf_names["SC_CLK_TCK"])
 except (AttributeError, OSError):
     SC_CLK_TCK = 100
 CPU_COUNT = os.cpu_count() or 1
+# /proc/<pid>/stat, status, children 都远小于一页
+PROC_READ_SIZE = 4096
+VMPEAK_RE = re.compile(rb"^VmPeak:\s+(\d+)\s+kB", re.M)
+# /proc/<pid>/task/<tid>/children 需要内核开启CONFIG_PROC_CHILDREN
+HAS_PROC_CHILDREN = os.path.exists(f"/proc/self/task/{os.getpid()}/children")
+# 执行时间短于此值时系统cpu计数几乎不变, 不计算cpu利用率
+MIN_CPU_UTIL_SECONDS = 0.2
+# /proc/stat 只在导入时打开一次, 之后每次用pread从头读取
+PROC_STAT_FD = None
+_thread_local = threading.local()
+if os.name == "posix":
+    try:
+        PROC_STAT_FD = os.open("/proc/stat", os.O_RDONLY)
+    except OSError:
+        pass
+
+
+def open_exit_fd(pid):
+    """返回子进程退出时变为可读的pidfd (Linux 5.3+), 不支持时返回None"""
+    pidfd_open = getattr(os, "pidfd_open", None)
+    if pidfd_open is None:
+        return None
+    try:
+        return pidfd_open(pid)
+    except OSError:
+        return None
 
+def decode_output(saved, size_holder):
+    """只解码已保存的前size_holder[0]字节, 有输出被丢弃时追加截断标记"""
+    data = saved[:size_holder[0]]
+    if size_holder[1]:
+        data += TRUNCATED_MARKER
+    return data.decode("utf-8", errors="ignore")
 
-def set_nonblocking(reader):
-    if fcntl is None:
-        return
-    fd = reader.fileno()
-    fl = fcntl.fcntl(fd, fcntl.F_GETFL)
-    fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
+def get_event_loop():
+    """Windows下每个线程复用同一个事件循环(ProactorEventLoop), 避免每次run都新建"""
+    loop = getattr(_thread_local, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = _thread_local.loop = asyncio.new_event_loop()
+    return loop
 
 def get_system_cpu():
-    if os.name != "posix" or not os.path.exists("/proc/stat"):
+    if PROC_STAT_FD is None:
         return 0
     try:
-        with open("/proc/stat") as proc_stat:
-            cpu_total = proc_stat.readline().strip().split()[1:]
-            cpu_total = [int(i) for i in cpu_total]
-            system_cpu = sum(cpu_total)
+        # 只需要第一行的cpu汇总: "cpu  user nice system idle ..."
+        buf = os.pread(PROC_STAT_FD, 1024, 0)
+        system_cpu = sum(map(int, buf.split(b"\n", 1)[0].split()[1:]))
     except Exception as _:
         system_cpu = 0
     return system_cpu
 
 
-def get_process_cpu_mem(pid):
+def read_proc_file(path):
+    """open+read+close三次系统调用读取/proc小文件, 不经过Python文件对象(fstat、isatty等额外调用)"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.read(fd, PROC_READ_SIZE)
+    finally:
+        os.close(fd)
+
+
+def get_descendant_pids(pid):
+    """返回pid的所有后代进程, 优先读取/proc/<pid>/task/<tid>/children, 内核不支持时回退到psutil"""
+    if not HAS_PROC_CHILDREN:
+        return [child.pid for child in psutil.Process(pid).children(recursive=True)]
+    descendants = []
+    pending = [pid]
+    while pending:
+        cur_pid = pending.pop()
+        try:
+            tids = os.listdir(f"/proc/{cur_pid}/task")
+        except OSError:
+            continue
+        for tid in tids:
+            try:
+                children = [int(child) for child in read_proc_file(f"/proc/{cur_pid}/task/{tid}/children").split()]
+            except OSError:
+                continue
+            descendants.extend(children)
+            pending.extend(children)
+    return descendants
+
+
+def get_process_cpu_mem(pid, cpu=True):
+    """返回pid及其后代进程的累计cpu时间(jiffies)和VmPeak之和(kB); cpu=False时只读取内存"""
     try:
-        parent = psutil.Process(pid)
         if os.name != "posix":
             # Windows: use psutil memory only
-            mem = parent.memory_info()
+            mem = psutil.Process(pid).memory_info()
             return 0, getattr(mem, "rss", mem[0]) // 1024
-        descendants = parent.children(recursive=True)
-        all_processes = [parent] + descendants
         process_cpu = 0
         process_peak_memory = 0
-        for process in all_processes:
-            with open(f"/proc/{process.pid}/stat") as pid_stat:
-                vals = pid_stat.read().split()
-                process_cpu += sum(map(float, vals[13:17]))
-            with open(f"/proc/{process.pid}/status") as pid_status:
-                vm_peak_line = [l for l in pid_status if l.startswith("VmPeak:")]
-                if len(vm_peak_line) != 0:
-                    vm_peak_line = vm_peak_line[0]
-                    vm_peak_line = vm_peak_line.split(":")[-1].strip()
-                    if vm_peak_line.endswith("kB"):
-                        process_peak_memory += int(vm_peak_line.split()[0])
-                    elif vm_peak_line.endswith("mB"):
-                        process_peak_memory += int(vm_peak_line.split()[0]) * 1024
-                    elif vm_peak_line.endswith("gB"):
-                        process_peak_memory += int(vm_peak_line.split()[0]) * 1024 * 1024
-                    else:
-                        process_peak_memory += int(vm_peak_line.split()[0])
+        for cur_pid in [pid] + get_descendant_pids(pid):
+            try:
+                if cpu:
+                    data = read_proc_file(f"/proc/{cur_pid}/stat")
+                    # 进程名可能包含空格, 从最后一个")"之后开始切分; utime/stime/cutime/cstime
+                    vals = data[data.rindex(b")") + 2:].split()
+                    process_cpu += sum(map(int, vals[11:15]))
+                m = VMPEAK_RE.search(read_proc_file(f"/proc/{cur_pid}/status"))
+                if m is not None:
+                    process_peak_memory += int(m.group(1))
+            except (OSError, ValueError):
+                # 进程已退出
+                continue
         return process_cpu, process_peak_memory
     except Exception as _:
         return 0, 0
@@ -95,7 +153,7 @@ def run(
         stdin=subprocess.DEVNULL,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
-        bufsize=MAX_BYTES_PER_READ,
+        bufsize=0,  # 管道只通过fd直接读取, 不需要BufferedReader
         shell=False,
         cwd=cwd,
     )
@@ -105,100 +163,208 @@ def run(
         popen_kw["start_new_session"] = True
     elif os.name == "nt" and hasattr(subprocess, "CREATE_NEW_PROCESS_GROUP"):
         popen_kw["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
-    p = subprocess.Popen(args, **popen_kw)
 
     system_cpu_start = get_system_cpu()
     process_cpu = 0
     process_peak_memory = 0
-
-    process_group_id = os.getpgid(p.pid) if hasattr(os, "getpgid") else None
+    p = None
+    process_group_id = None
 
     # On Windows pipes are blocking; reading one while child writes to the other deadlocks.
-    # Use threads to read both streams, or non-blocking I/O on Unix.
-    stdout_saved_bytes = []
-    stderr_saved_bytes = []
-    stdout_bytes_read = [0]  # use list so closure can mutate
-    stderr_bytes_read = [0]
+    # Use asyncio (IOCP) to read both streams, or non-blocking I/O on Unix.
+    # 输出直接写入预分配的缓冲区, 写满后继续读出并丢弃, 避免子进程因管道写满而阻塞
+    stdout_saved_bytes = bytearray(max_output_size)
+    stderr_saved_bytes = bytearray(max_output_size)
+    stdout_bytes_read = [0, False]  # [已保存字节数, 是否有输出被丢弃]; use list so closure can mutate
+    stderr_bytes_read = [0, False]
 
-    def read_stream(stream, out_list, size_holder):
-        try:
-            while size_holder[0] < max_output_size:
-                chunk = stream.read(MAX_BYTES_PER_READ)
-                if not chunk:
-                    break
-                out_list.append(chunk)
-                size_holder[0] += len(chunk)
-        except Exception:
-            pass
+    def sample(cpu=True):
+        nonlocal process_cpu, process_peak_memory, next_sample, sample_interval
         try:
-            stream.close()
+            cur_cpu, cur_mem = get_process_cpu_mem(p.pid, cpu=cpu)
+            process_cpu = max(process_cpu, cur_cpu or 0)
+            process_peak_memory = max(process_peak_memory, cur_mem or 0)
         except Exception:
             pass
+        next_sample = time.monotonic() + sample_interval
+        sample_interval = min(sample_interval * 2, SAMPLE_INTERVAL_MAX)
+
+    deadline = time.monotonic() + timeout_seconds
+    sample_interval = SLEEP_BETWEEN_READS
+    next_sample = 0
+    exit_code = None
 
     if os.name == "nt":
-        t_out = threading.Thread(target=read_stream, args=(p.stdout, stdout_saved_bytes, stdout_bytes_read))
-        t_err = threading.Thread(target=read_stream, args=(p.stderr, stderr_saved_bytes, stderr_bytes_read))
-        t_out.daemon = True
-        t_err.daemon = True
-        t_out.start()
-        t_err.start()
-        max_iterations = timeout_seconds * 10
-        for _ in range(max_iterations):
+        # asyncio的子进程管道是overlapped的, 两个管道和进程退出都在同一个事件循环中等待
+        async_kw = {k: v for k, v in popen_kw.items() if k not in ("bufsize", "shell")}
+
+        async def read_stream(stream, saved, size_holder):
+            while True:
+                chunk = await stream.read(MAX_BYTES_PER_READ)
+                if not chunk:
+                    break
+                n = size_holder[0]
+                if len(chunk) > max_output_size - n:
+                    size_holder[1] = True
+                    chunk = chunk[:max_output_size - n]
+                if chunk:
+                    saved[n:n + len(chunk)] = chunk
+                    size_holder[0] = n + len(chunk)
+
+        async def wait_exit():
+            # p.wait()要等管道全部关闭才返回, 子进程留下的后台进程持有管道时会一直阻塞;
+            # returncode在进程退出时即被设置, 与管道无关, 因此轮询它并顺带采样
+            while p.returncode is None:
+                now = time.monotonic()
+                if now >= next_sample:
+                    sample()
+                remaining = deadline - now
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(min(remaining, next_sample - now, SLEEP_BETWEEN_READS))
+
+        async def communicate():
+            nonlocal p, exit_code
+            p = await asyncio.create_subprocess_exec(*args, **async_kw)
+            readers = asyncio.gather(
+                read_stream(p.stdout, stdout_saved_bytes, stdout_bytes_read),
+                read_stream(p.stderr, stderr_saved_bytes, stderr_bytes_read),
+            )
             try:
-                cur_cpu, cur_mem = get_process_cpu_mem(p.pid)
-                process_peak_memory = max(process_peak_memory, cur_mem or 0)
-            except Exception:
-                pass
-            exit_code = p.poll()
-            if exit_code is not None:
-                break
-            time.sleep(SLEEP_BETWEEN_READS)
-        t_out.join(timeout=0.5)
-        t_err.join(timeout=0.5)
+                await wait_exit()
+                exit_code = p.returncode
+                if exit_code is None:
+                    p.kill()
+                    try:
+                        await asyncio.wait_for(p.wait(), 1)
+                    except asyncio.TimeoutError:
+                        pass
+                try:
+                    await asyncio.wait_for(readers, 0.5)
+                except asyncio.TimeoutError:
+                    pass
+            finally:
+                readers.cancel()
+                await asyncio.gather(readers, return_exceptions=True)
+                # 关闭管道transport, 否则残留的读操作会留在本线程复用的事件循环中
+                p._transport.close()
+
+        get_event_loop().run_until_complete(communicate())
     else:
-        set_nonblocking(p.stdout)
-        set_nonblocking(p.stderr)
-        max_iterations = timeout_seconds * 10
-        for _ in range(max_iterations):
-            try:
-                cur_cpu, cur_mem = get_process_cpu_mem(p.pid)
-                process_peak_memory = max(process_peak_memory, cur_mem or 0)
-            except Exception:
-                pass
-            this_stdout_read = p.stdout.read(MAX_BYTES_PER_READ)
-            this_stderr_read = p.stderr.read(MAX_BYTES_PER_READ)
-            if this_stdout_read and stdout_bytes_read[0] < max_output_size:
-                stdout_saved_bytes.append(this_stdout_read)
-                stdout_bytes_read[0] += len(this_stdout_read)
-            if this_stderr_read and stderr_bytes_read[0] < max_output_size:
-                stderr_saved_bytes.append(this_stderr_read)
-                stderr_bytes_read[0] += len(this_stderr_read)
+        p = subprocess.Popen(args, **popen_kw)
+        # 新会话的组号即子进程pid; 没有独立进程组时不能按组清理, 否则会杀掉本进程所在的组
+        if SANDBOX_UID is not None:
+            process_group_id = p.pid
+
+        # 用selector等待管道数据或进程退出(pidfd), 而不是固定间隔轮询
+        stdout_fd = p.stdout.fileno()
+        stderr_fd = p.stderr.fileno()
+        os.set_blocking(stdout_fd, False)
+        os.set_blocking(stderr_fd, False)
+        streams = {
+            stdout_fd: (memoryview(stdout_saved_bytes), stdout_bytes_read),
+            stderr_fd: (memoryview(stderr_saved_bytes), stderr_bytes_read),
+        }
+        discard = memoryview(bytearray(MAX_BYTES_PER_READ))
+        selector = selectors.DefaultSelector()
+        for fd in streams:
+            selector.register(fd, selectors.EVENT_READ)
+        exit_fd = open_exit_fd(p.pid)
+        if exit_fd is not None:
+            selector.register(exit_fd, selectors.EVENT_READ)
+
+        def drain(ready):
+            exited = False
+            for key, _ in ready:
+                if key.fd == exit_fd:
+                    exited = True
+                    continue
+                saved, size_holder = streams[key.fd]
+                # 一次唤醒内读空管道; 短读说明已读空, 超出max_output_size的部分读入discard丢弃
+                while True:
+                    n = size_holder[0]
+                    buf = saved[n:n + MAX_BYTES_PER_READ] if n < max_output_size else discard
+                    try:
+                        nread = os.readv(key.fd, [buf])
+                    except BlockingIOError:
+                        break
+                    if nread == 0:
+                        selector.unregister(key.fd)
+                        break
+                    if buf is not discard:
+                        size_holder[0] = n + nread
+                    else:
+                        size_holder[1] = True
+                    if nread < len(buf) or time.monotonic() >= deadline:
+                        break
+            return exited
+
+        try:
+            while True:
+                now = time.monotonic()
+                # cpu时间是累计计数, 退出时采样一次即可; 周期采样只为VmPeak
+                # (进程退出后/proc/<pid>/status不再有VmPeak)。无pidfd时进程在循环内被回收, 仍需周期采样cpu
+                if now >= next_sample:
+                    sample(cpu=exit_fd is None)
+                remaining = deadline - now
+                if remaining <= 0:
+                    break
+                wait = min(remaining, next_sample - now)
+                if exit_fd is None:
+                    wait = min(wait, SLEEP_BETWEEN_READS)
+                if drain(selector.select(max(wait, 0))):
+                    break
+                if exit_fd is None and p.poll() is not None:
+                    break
+            # 读取子进程退出前写入但尚未读取的输出
+            while len(selector.get_map()) > (exit_fd is not None):
+                ready = [(key, ev) for key, ev in selector.select(0) if key.fd != exit_fd]
+                if not ready:
+                    break
+                drain(ready)
+            # 退出后(回收前)的僵尸进程仍保留累计cpu时间; 超时时在kill之前采样
+            sample()
             exit_code = p.poll()
-            if exit_code is not None:
-                break
-            time.sleep(SLEEP_BETWEEN_READS)
+        finally:
+            selector.close()
+            if exit_fd is not None:
+                os.close(exit_fd)
+            p.stdout.close()
+            p.stderr.close()
 
-    try:
-        if process_group_id is not None:
+    if exit_code is None and os.name != "nt":
+        # 超时: 杀掉子进程(沙箱下为整个进程组)并立即回收, 避免残留僵尸进程
+        try:
+            if process_group_id is not None:
+                os.killpg(process_group_id, signal.SIGKILL)
+            else:
+                p.kill()
+        except OSError:
+            pass
+        try:
+            p.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            pass
+    elif process_group_id is not None:
+        # 正常退出: 进程组内可能仍有后台子进程(如构建服务进程), 一并清理
+        try:
             os.killpg(process_group_id, signal.SIGKILL)
-        else:
-            p.kill()
-    except (ProcessLookupError, OSError):
-        pass
+        except OSError:
+            pass
 
     timeout = exit_code is None
     exit_code = exit_code if exit_code is not None else -1
-    stdout = b"".join(stdout_saved_bytes).decode("utf-8", errors="ignore")
-    stderr = b"".join(stderr_saved_bytes).decode("utf-8", errors="ignore")
-    system_cpu_end = get_system_cpu()
-    if system_cpu_start != system_cpu_end:
-        process_cpu_util = (
-            process_cpu / (system_cpu_end - system_cpu_start) * 100 * CPU_COUNT
-        )
-    else:
-        process_cpu_util = 0
+    stdout = decode_output(stdout_saved_bytes, stdout_bytes_read)
+    stderr = decode_output(stderr_saved_bytes, stderr_bytes_read)
     end_time = time.time()
     process_exec_time = end_time - start_time
+    process_cpu_util = 0
+    if process_exec_time >= MIN_CPU_UTIL_SECONDS:
+        system_cpu_end = get_system_cpu()
+        if system_cpu_start != system_cpu_end:
+            process_cpu_util = (
+                process_cpu / (system_cpu_end - system_cpu_start) * 100 * CPU_COUNT
+            )
     result = {
         "cmd": args, # 最终执行的命令
         "timeout": timeout,